@@ -1,13 +1,24 @@
 #!/usr/bin/env python3
-import json
 import os
+import gc
+import socket
 import asyncio
 import aiohttp
+from aiohttp.resolver import AsyncResolver
 import time
 import gzip
-from urllib.parse import urljoin, urldefrag, urlparse
-from bs4 import BeautifulSoup
-import xml.etree.ElementTree as ET
+import zlib
+import math
+import hashlib
+import io
+import struct
+import heapq
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict, deque
+from urllib.parse import urljoin, urlsplit, urlunsplit
+from selectolax.lexbor import LexborHTMLParser
+from lxml import etree
 
 # ANSI colors (safe on most terminals)
 GREEN = "\033[92m"
@@ -23,17 +34,34 @@ def clear_block():
 CONCURRENCY = 100
 DOMAIN_DELAY = 10
 GLOBAL_URLS_PER_SEC = 200
+MAX_QUEUED_URLS = 100_000
 AUTO_SHUTDOWN_SECONDS = 600
+LIMIT_PER_HOST = 8
+MAX_HTML_BYTES = 2_000_000
+DNS_CACHE_TTL = 600
+NORMALIZE_CACHE_SIZE = 50_000
+IPV4_ONLY = True  # A lookups only; no AAAA queries or IPv6 connect attempts
 
 START_FILE = "startsearch.txt"
 
 BUILD_DIR = "./crawler_build"
 os.makedirs(BUILD_DIR, exist_ok=True)
 
+SNAPSHOT_INTERVAL = 30
+BLOOM_SNAPSHOT_INTERVAL = 300
+ERROR_BATCH_SIZE = 500
+
+BLOOM_CAPACITY = 5_000_000
+BLOOM_ERROR_RATE = 1e-5
+RECENT_URLS = 10_000
+GC_THRESHOLD = (50_000, 20, 20)
+PARSE_OFFLOAD_BYTES = 128 * 1024
+PARSE_THREADS = 2
+
 QUEUE_FILE = f"{BUILD_DIR}/queue.json"
-VISITED_FILE = f"{BUILD_DIR}/visited.json"
-FOUND_FILE = f"{BUILD_DIR}/found.json"
-ERROR_FILE = f"{BUILD_DIR}/error.json"
+VISITED_FILE = f"{BUILD_DIR}/visited.jsonl"
+FOUND_FILE = f"{BUILD_DIR}/found.jsonl"
+ERROR_FILE = f"{BUILD_DIR}/error.jsonl"
 STATS_FILE = f"{BUILD_DIR}/stats.json"
 HEADERS = {
     "User-Agent": (
@@ -44,20 +72,69 @@ HEADERS = {
 }
 
 # JSON HELPERS
+# orjson when installed; stdlib json (same compact bytes output) otherwise
+try:
+    import orjson
+
+    json_loads = orjson.loads
+    json_dumps = orjson.dumps
+except ImportError:
+    import json
+
+    json_loads = json.loads
+
+    def json_dumps(data):
+        return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
 def load_json(path, default):
     if not os.path.exists(path):
         return default
-    with open(path, "r") as f:
-        return json.load(f)
+    with open(path, "rb") as f:
+        return json_loads(f.read())
+
+def save_bytes(path, data):
+    # Write a sibling temp file and swap it in, so a kill mid-write never
+    # leaves a truncated snapshot behind
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
 
 def save_json(path, data):
-    with open(path, "w") as f:
-        json.dump(data, f, indent=2)
+    save_bytes(path, json_dumps(data))
+
+# JSONL HELPERS (append-only, one entry per line)
+def load_jsonl(path, offset=0):
+    if not os.path.exists(path):
+        return []
+    with open(path, "rb") as f:
+        f.seek(offset)
+        return [json_loads(line) for line in f if line.strip()]
+
+# Long-lived append handle: one buffered write() per 64 KB instead of an
+# open/write/close per URL
+class JsonlLog:
+    def __init__(self, path):
+        self.path = path
+        self.f = open(path, "ab", buffering=65536)
+
+    def append(self, entry):
+        self.f.write(json_dumps(entry) + b"\n")
+
+    def flush(self):
+        self.f.flush()
+
+    def offset(self):
+        # Bytes on disk so far, i.e. where the next run's replay should start
+        self.f.flush()
+        return self.f.tell()
+
+    def close(self):
+        self.f.close()
 
-def append_json(path, entry):
-    data = load_json(path, [])
-    data.append(entry)
-    save_json(path, data)
+def append_jsonl_batch(path, entries):
+    with open(path, "ab") as f:
+        f.write(b"".join(json_dumps(e) + b"\n" for e in entries))
 
 # SEED LOADING
 def load_seeds():
@@ -69,196 +146,471 @@ def load_seeds():
                 seeds.append((normalize(url), 0))
     return seeds
 
+# BLOOM FILTER
+# Set-like membership in a fixed bit array: no false negatives, rare false
+# positives (a URL wrongly treated as seen), ~3 bytes per URL at 1e-5.
+class BloomFilter:
+    def __init__(self, capacity, error_rate):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        size = self.size
+        return [(h1 + i * h2) % size for i in range(self.hashes)]
+
+    def __contains__(self, item):
+        bits = self.bits
+        for p in self._positions(item):
+            if not bits[p >> 3] & (1 << (p & 7)):
+                return False
+        return True
+
+    def add(self, item):
+        bits = self.bits
+        added = False
+        for p in self._positions(item):
+            mask = 1 << (p & 7)
+            if not bits[p >> 3] & mask:
+                bits[p >> 3] |= mask
+                added = True
+        if added:
+            self.count += 1
+
+    def __len__(self):
+        return self.count
+
+# Snapshot next to each log: header (size, hashes, count, log offset) then
+# the raw bits. Restoring it and replaying only the log tail past the offset
+# replaces re-hashing every URL ever logged on each restart.
+BLOOM_HEADER = struct.Struct("<4Q")
+
+def save_bloom(bloom, log):
+    # Every add is paired with its log append in the same step, so the bits
+    # cover everything written before the offset
+    header = BLOOM_HEADER.pack(bloom.size, bloom.hashes, bloom.count, log.offset())
+    save_bytes(f"{log.path}.bloom", header + bloom.bits)
+
+def load_bloom(path):
+    bloom = BloomFilter(BLOOM_CAPACITY, BLOOM_ERROR_RATE)
+    offset = 0
+    try:
+        with open(f"{path}.bloom", "rb") as f:
+            size, hashes, count, snap_offset = BLOOM_HEADER.unpack(f.read(BLOOM_HEADER.size))
+            # Only usable with the same geometry and a log that still reaches
+            # the recorded offset; otherwise fall back to a full replay
+            if size == bloom.size and hashes == bloom.hashes and snap_offset <= os.path.getsize(path):
+                if f.readinto(bloom.bits) == len(bloom.bits):
+                    bloom.count = count
+                    offset = snap_offset
+                else:
+                    bloom = BloomFilter(BLOOM_CAPACITY, BLOOM_ERROR_RATE)
+    except (OSError, struct.error):
+        pass
+    for url in load_jsonl(path, offset):
+        bloom.add(url)
+    return bloom
+
+# Exact FIFO set of the most recently seen URLs, checked before the Bloom
+# filters: a hit costs one dict lookup instead of two rounds of hashing
+class RecentUrls:
+    def __init__(self, size):
+        self.size = size
+        self.items = OrderedDict()
+
+    def __contains__(self, url):
+        return url in self.items
+
+    def add(self, url):
+        items = self.items
+        if url in items:
+            return
+        items[url] = None
+        if len(items) > self.size:
+            items.popitem(last=False)
+
 # STATE
 def load_state():
-    queue = load_json(QUEUE_FILE, load_seeds())
-    visited = set(load_json(VISITED_FILE, []))
-    found = set(load_json(FOUND_FILE, []))
+    queue = load_json(QUEUE_FILE, None)
+    if queue is None:
+        queue = load_seeds()
+    visited = load_bloom(VISITED_FILE)
+    found = load_bloom(FOUND_FILE)
     return queue, visited, found
 
-def save_state(queue, visited, found):
+def save_queue(queue):
     save_json(QUEUE_FILE, queue)
-    save_json(VISITED_FILE, list(visited))
-    save_json(FOUND_FILE, list(found))
 
 # NORMALIZATION
-def normalize(url):
+DEFAULT_PORTS = {"http": "80", "https": "443"}
+
+# Nav/footer links recur on every page of a site; the cache turns their
+# urlsplit/urlunsplit round trip into a dict hit
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def normalize_with_domain(url):
+    # Canonical form: lowercase scheme/host, no default port, sorted query,
+    # no fragment, no trailing slash. Returns (url, netloc) so callers never
+    # have to parse the URL again just to find its domain.
     if not url:
-        return ""
-    clean, _ = urldefrag(url)
-    return clean.rstrip("/")
+        return "", ""
+    try:
+        parts = urlsplit(url.strip())
+    except ValueError:
+        return "", ""
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+    host, sep, port = netloc.rpartition(":")
+    if sep and port == DEFAULT_PORTS.get(scheme):
+        netloc = host
+    query = parts.query
+    if "&" in query:
+        query = "&".join(sorted(query.split("&")))
+    return urlunsplit((scheme, netloc, parts.path, query, "")).rstrip("/"), netloc
+
+def normalize(url):
+    return normalize_with_domain(url)[0]
+
+# Static assets are recorded as found but never fetched: they cannot yield
+# links and only come back as NONHTML errors. A tuple lets str.endswith do
+# the whole comparison in one C call.
+SKIP_EXTENSIONS = (
+    ".png", ".jpg", ".jpeg", ".gif", ".svg", ".ico", ".webp", ".bmp",
+    ".css", ".js", ".woff", ".woff2", ".ttf", ".eot",
+    ".pdf", ".zip", ".gz", ".tar", ".rar", ".7z", ".exe", ".dmg", ".iso",
+    ".mp3", ".mp4", ".avi", ".mov", ".webm", ".wav",
+)
+
+def has_skip_extension(url, dom):
+    # `url` is already normalized (no fragment), so its path runs from the end
+    # of the netloc to the first "?"; slicing saves a second urlsplit per link
+    path = url.partition("?")[0]
+    if dom:
+        path = path.partition(dom)[2]
+    return path.lower().endswith(SKIP_EXTENSIONS)
 
 def should_skip(url, visited, found):
     return not url or url in visited or url in found
 
 # URL EXTRACTION
-def extract_all_urls(soup, base_url):
+LINK_ATTRS = {
+    "a": "href",
+    "area": "href",
+    "link": "href",
+    "script": "src",
+    "img": "src",
+    "iframe": "src",
+    "source": "src",
+    "form": "action",
+    "button": "formaction",
+}
+LINK_SELECTOR = ", ".join(f"{tag}[{attr}]" for tag, attr in LINK_ATTRS.items())
+SKIP_SCHEMES = frozenset({"mailto", "tel", "javascript", "data", "blob", "about", "ftp"})
+
+def extract_all_urls(tree, base_url):
     urls = set()
+    base = urlsplit(base_url)
+    origin = f"{base.scheme}://{base.netloc}"
+
+    # One selector pass over all link tags, reading only each tag's link attribute
+    values = set()
+    for node in tree.css(LINK_SELECTOR):
+        value = node.attrs.get(LINK_ATTRS[node.tag])
+        if value:
+            values.add(value.strip())
+
+    # Nav/footer links repeat a lot; join each distinct value only once
+    for value in values:
+        colon = value.find(":")
+        if colon > 0 and value[:colon].lower() in SKIP_SCHEMES:
+            continue
 
-    def add(attr, tag):
-        for t in soup.find_all(tag, **{attr: True}):
+        # Plain string joins for the common shapes; urljoin only for the rest
+        if value.startswith(("http://", "https://")):
+            urls.add(value)
+        elif value.startswith("//"):
+            urls.add(f"{base.scheme}:{value}")
+        elif value.startswith("/") and "/." not in value:
+            urls.add(origin + value)
+        elif value:
             try:
-                urls.add(urljoin(base_url, t[attr]))
-            except:
+                urls.add(urljoin(base_url, value))
+            except ValueError:
                 pass
 
-    add("href", "a")
-    add("src", "script")
-    add("href", "link")
-    add("src", "img")
-    add("action", "form")
-    add("formaction", "button")
-
-    return {normalize(u) for u in urls if u}
+    normalized = {normalize_with_domain(u) for u in urls}
+    normalized.discard(("", ""))
+    return normalized
 
 # FETCHERS
+async def read_capped(resp, limit):
+    # StreamReader.read(n) may return less than n, so loop up to the cap
+    chunks = []
+    size = 0
+    while size < limit:
+        chunk = await resp.content.read(limit - size)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        size += len(chunk)
+    return b"".join(chunks)
+
+def decode_body(data, charset):
+    try:
+        return data.decode(charset or "utf-8", errors="replace")
+    except LookupError:
+        return data.decode("utf-8", errors="replace")
+
+def html_body(data, charset):
+    # Lexbor reads UTF-8 bytes natively, so a pure-ASCII body (the same bytes
+    # in any ASCII-compatible charset) skips the decode and re-encode. Other
+    # bytes are decoded first: invalid UTF-8 would break attribute access.
+    if data.isascii() and not (charset or "").lower().startswith(("utf-16", "utf-32")):
+        return data
+    return decode_body(data, charset)
+
+# Ask servers that honour Range not to send more than we will read
+HTML_RANGE = {"Range": f"bytes=0-{MAX_HTML_BYTES - 1}"}
+
+# A per-request timeout replaces the session's whole ClientTimeout, so each
+# one carries the socket limits along with its own total
+HTML_TIMEOUT = aiohttp.ClientTimeout(total=15, sock_connect=10, sock_read=15)
+TEXT_TIMEOUT = aiohttp.ClientTimeout(total=20, sock_connect=10, sock_read=15)
+BYTES_TIMEOUT = aiohttp.ClientTimeout(total=30, sock_connect=10, sock_read=15)
+
 async def fetch_html(session, url):
     try:
-        async with session.get(url, headers=HEADERS, timeout=15) as resp:
-            if resp.status != 200:
+        async with session.get(url, timeout=HTML_TIMEOUT, headers=HTML_RANGE) as resp:
+            if resp.status not in (200, 206):
                 return None, resp.status, None, "HTTP"
             ctype = resp.headers.get("Content-Type", "").lower()
-            if "text/html" not in ctype:
+            # Bail out on the headers alone; leaving the context without
+            # reading closes the connection instead of draining the body
+            if "html" not in ctype:
                 return None, resp.status, ctype, "NONHTML"
-            text = await resp.text()
-            if not text.strip():
+            if (resp.content_length or 0) > MAX_HTML_BYTES:
+                return None, resp.status, ctype, "TOOLARGE"
+            # Read at most MAX_HTML_BYTES and decode with the declared charset
+            data = await read_capped(resp, MAX_HTML_BYTES)
+            body = html_body(data, resp.charset)
+            if not body.strip():
                 return None, resp.status, ctype, "EMPTY"
-            return text, resp.status, ctype, None
-    except:
+            return body, resp.status, ctype, None
+    # CancelledError is not caught here, so shutdown still stops the worker
+    except Exception:
         return None, None, None, "ERROR"
 
 async def fetch_text(session, url):
     try:
-        async with session.get(url, headers=HEADERS, timeout=20) as resp:
+        async with session.get(url, timeout=TEXT_TIMEOUT) as resp:
             if resp.status != 200:
                 return None
             return await resp.text()
-    except:
+    except Exception:
         return None
 
 async def fetch_bytes(session, url):
     try:
-        async with session.get(url, headers=HEADERS, timeout=30) as resp:
+        async with session.get(url, timeout=BYTES_TIMEOUT) as resp:
             if resp.status != 200:
                 return None
             return await resp.read()
-    except:
+    except Exception:
         return None
 
 # SITEMAP PARSER
-def parse_sitemap_xml(xml_text):
+def parse_sitemap_xml(data):
     urls = set()
     links = set()
 
+    source = io.BytesIO(data)
+    if data[:2] == b"\x1f\x8b":
+        source = gzip.GzipFile(fileobj=source)
+
+    # Stream <url>/<sitemap> entries and drop each one once read, so memory
+    # stays flat even for 50k-entry sitemaps
     try:
-        root = ET.fromstring(xml_text)
-    except:
-        return urls, links
-
-    for elem in root.iter():
-        tag = elem.tag.lower()
-        if tag.endswith("loc") and elem.text:
-            t = elem.text.strip()
-            if t.endswith(".xml") or t.endswith(".xml.gz"):
-                links.add(t)
-            else:
-                urls.add(t)
+        for _, elem in etree.iterparse(
+            source,
+            events=("end",),
+            tag=("{*}url", "{*}sitemap"),
+            resolve_entities=False,
+        ):
+            loc = elem.findtext("{*}loc")
+            if loc:
+                t = loc.strip()
+                if t.endswith(".xml") or t.endswith(".xml.gz"):
+                    links.add(t)
+                elif t:
+                    urls.add(t)
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+    except (etree.XMLSyntaxError, OSError, EOFError, zlib.error):
+        # Keep whatever was parsed before the broken/truncated part
+        pass
 
     return urls, links
 
 # RATE LIMITER
+# Token bucket on the monotonic clock. Each caller takes a token right away
+# (the balance may go negative) and sleeps off its own deficit, so there is
+# no lock and no polling loop.
 class UrlRateLimiter:
     def __init__(self, max_per_sec):
-        self.max = max_per_sec
-        self.count = 0
-        self.start = time.time()
-        self.lock = asyncio.Lock()
+        self.rate = max_per_sec
+        self.tokens = float(max_per_sec)
+        self.last = time.monotonic()
 
     async def wait(self):
-        while True:
-            async with self.lock:
-                now = time.time()
-                if now - self.start >= 1:
-                    self.start = now
-                    self.count = 0
-                if self.count < self.max:
-                    self.count += 1
-                    return
-                sleep = 1 - (now - self.start)
-            if sleep > 0:
-                await asyncio.sleep(sleep)
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        self.tokens -= 1
+        if self.tokens < 0:
+            await asyncio.sleep(-self.tokens / self.rate)
 
 # DOMAIN QUEUE
 class DomainQueue:
-    def __init__(self, visited, found, limiter):
+    def __init__(self, visited, found, found_log, limiter):
         self.queues = {}
         self.last = {}
-        self.domains = []
-        self.lock = asyncio.Lock()
+        self.size = 0
+
+        # Min-heap of (next allowed fetch time, domain), holding exactly the
+        # domains with a non-empty queue, so get() never scans every domain
+        self.ready = []
+        self.wakeup = asyncio.Event()
 
         self.visited = visited
         self.found = found
+        self.found_log = found_log
         self.limiter = limiter
+        self.recent = RecentUrls(RECENT_URLS)
 
         self.sitemap_done = set()
         self.sitemap_processed = set()
 
-    def add_seed(self, url, depth):
-        url = normalize(url)
-        if should_skip(url, self.visited, self.found):
+        # Set whenever the queue changes; cleared by the snapshot timer
+        self.dirty = False
+
+        # Like asyncio.Queue.join: URLs queued but not yet fully processed.
+        # At zero no worker can discover anything new, so the crawl is done.
+        self.unfinished = 0
+        self.finished = asyncio.Event()
+        self.finished.set()
+
+        # Items handed out by get() but not yet task_done(), by URL. They are
+        # already in `found`, so without this a shutdown mid-fetch would drop
+        # them from the snapshot and no later run would queue them again.
+        self.in_flight = {}
+
+    def _push(self, url, dom, depth):
+        q = self.queues.get(dom)
+        if q is None:
+            q = self.queues[dom] = deque()
+        if not q:
+            last = self.last.get(dom)
+            due = time.monotonic() if last is None else last + DOMAIN_DELAY
+            heapq.heappush(self.ready, (due, dom))
+            self.wakeup.set()
+        q.append((url, dom, depth))
+        self.size += 1
+        self.unfinished += 1
+        self.finished.clear()
+        self.dirty = True
+
+    def add_seeds(self, entries):
+        # Snapshot entries are already in `found`, so only visited ones are
+        # dropped; `queued` catches lines that normalize to the same URL
+        queued = set()
+        for url, depth in entries:
+            url, dom = normalize_with_domain(url)
+            if not url or url in self.visited or url in queued:
+                continue
+            queued.add(url)
+            if url not in self.found:
+                self.found.add(url)
+                self.found_log.append(url)
+            self._push(url, dom, depth)
+
+    async def add_url(self, url, dom, depth):
+        # `url` must already be normalized; `found` doubles as the enqueued set
+        # so each URL is queued at most once
+        if url in self.recent:
             return
-        self.found.add(url)
-        dom = urlparse(url).netloc
-        if dom not in self.queues:
-            self.queues[dom] = asyncio.Queue()
-            self.domains.append(dom)
-        self.queues[dom].put_nowait((url, depth))
-
-    async def add_url(self, url, depth):
-        url = normalize(url)
         if should_skip(url, self.visited, self.found):
+            self.recent.add(url)
+            return
+
+        # Full frontier: drop the link without marking it found, so it can
+        # still be picked up from another page once the queue drains. Checked
+        # before the limiter so a dropped link never costs a token.
+        if self.size >= MAX_QUEUED_URLS:
             return
 
         await self.limiter.wait()
 
-        if should_skip(url, self.visited, self.found):
+        # Re-check after the wait: other workers may have filled the frontier
+        # or queued this URL in the meantime
+        if self.size >= MAX_QUEUED_URLS or should_skip(url, self.visited, self.found):
             return
 
         self.found.add(url)
-        dom = urlparse(url).netloc
-        if dom not in self.queues:
-            self.queues[dom] = asyncio.Queue()
-            self.domains.append(dom)
-        self.queues[dom].put_nowait((url, depth))
+        self.found_log.append(url)
+        self.recent.add(url)
+        if has_skip_extension(url, dom):
+            return
+        self._push(url, dom, depth)
 
     async def get(self):
         while True:
-            async with self.lock:
-                now = time.time()
-                for dom in self.domains:
+            now = time.monotonic()
+            timeout = None
+            if self.ready:
+                due, dom = self.ready[0]
+                if due <= now:
+                    heapq.heappop(self.ready)
                     q = self.queues[dom]
-                    if q.empty():
-                        continue
-                    if now - self.last.get(dom, 0) < DOMAIN_DELAY:
-                        continue
-                    item = await q.get()
+                    item = q.popleft()
+                    self.size -= 1
                     self.last[dom] = now
+                    if q:
+                        heapq.heappush(self.ready, (now + DOMAIN_DELAY, dom))
+                    self.in_flight[item[0]] = item
+                    self.dirty = True
                     return item
-            await asyncio.sleep(0.05)
+                timeout = due - now
 
-    def task_done(self, url):
-        dom = urlparse(url).netloc
-        if dom in self.queues:
-            self.queues[dom].task_done()
+            # Sleep until the earliest domain is due or a new one shows up
+            self.wakeup.clear()
+            timer = None
+            if timeout is not None:
+                timer = asyncio.get_running_loop().call_later(timeout, self.wakeup.set)
+            try:
+                await self.wakeup.wait()
+            finally:
+                if timer is not None:
+                    timer.cancel()
 
     def dump_state(self):
-        out = []
+        out = [(url, depth) for url, _, depth in self.in_flight.values()]
         for q in self.queues.values():
-            out.extend(list(q._queue))
+            out.extend((url, depth) for url, _, depth in q)
         return out
 
-    def empty(self):
-        return all(q.empty() for q in self.queues.values())
+    def task_done(self, item):
+        self.in_flight.pop(item[0], None)
+        self.dirty = True
+        self.unfinished -= 1
+        if self.unfinished == 0:
+            self.finished.set()
+
+    async def join(self):
+        await self.finished.wait()
 
     async def ensure_sitemaps(self, session, domain):
         if domain in self.sitemap_done:
@@ -273,18 +625,6 @@ class DomainQueue:
             f"{base_http}/robots.txt",
         ]
 
-        sitemaps = set()
-
-        for r in robots_list:
-            txt = await fetch_text(session, r)
-            if not txt:
-                continue
-            for line in txt.splitlines():
-                if line.lower().startswith("sitemap:"):
-                    sm = line.split(":", 1)[1].strip()
-                    if sm:
-                        sitemaps.add(sm)
-
         common = [
             f"{base_https}/sitemap.xml",
             f"{base_https}/sitemap_index.xml",
@@ -296,11 +636,24 @@ class DomainQueue:
             f"{base_http}/sitemap_index.xml.gz",
         ]
 
-        for sm in common:
-            sitemaps.add(sm)
+        # Probe robots.txt and the common sitemap locations concurrently
+        robots, _ = await asyncio.gather(
+            asyncio.gather(*(fetch_text(session, r) for r in robots_list)),
+            asyncio.gather(*(self.process_sitemap(session, sm) for sm in common)),
+        )
+
+        sitemaps = set()
+
+        for txt in robots:
+            if not txt:
+                continue
+            for line in txt.splitlines():
+                if line.lower().startswith("sitemap:"):
+                    sm = line.split(":", 1)[1].strip()
+                    if sm:
+                        sitemaps.add(sm)
 
-        for sm in sitemaps:
-            await self.process_sitemap(session, sm)
+        await asyncio.gather(*(self.process_sitemap(session, sm) for sm in sitemaps))
 
     async def process_sitemap(self, session, sm_url):
         sm_url = normalize(sm_url)
@@ -308,110 +661,178 @@ class DomainQueue:
             return
         self.sitemap_processed.add(sm_url)
 
-        xml_text = None
-
-        if sm_url.endswith(".gz"):
-            data = await fetch_bytes(session, sm_url)
-            if not data:
-                return
-            try:
-                xml_text = gzip.decompress(data).decode("utf-8", "replace")
-            except:
-                return
-        else:
-            xml_text = await fetch_text(session, sm_url)
-
-        if not xml_text:
+        data = await fetch_bytes(session, sm_url)
+        if not data:
             return
 
-        urls, links = parse_sitemap_xml(xml_text)
+        urls, links = parse_sitemap_xml(data)
+        del data
 
         for u in urls:
-            await self.add_url(u, 0)
+            await self.add_url(*normalize_with_domain(u), 0)
 
+        # Children one at a time: a large sitemap index must not hold
+        # thousands of sitemap bodies in memory at once
         for l in links:
             await self.process_sitemap(session, l)
 
-# WORKER
-# Global counters
-TOTAL_ATTEMPTS = 0
-ATTEMPT_TIMES = []
-SUCCESS_TIMES = []
-ERROR_TIMES = []
-
-# Global counters
-TOTAL_ATTEMPTS = 0
-ATTEMPT_TIMES = []
-SUCCESS_TIMES = []
-ERROR_TIMES = []
-
-async def worker(dq, session, visited, found, lock):
-    global TOTAL_ATTEMPTS, ATTEMPT_TIMES, SUCCESS_TIMES, ERROR_TIMES
+# COUNTERS
+# Per-second event counts in a fixed ring of buckets: recording is O(1) and
+# window sums cost O(size) no matter how long the crawl has been running
+class RollingCounter:
+    def __init__(self, size=60):
+        self.size = size
+        self.counts = [0] * size
+        self.stamps = [0] * size
+        self.total = 0
+
+    def add(self, ts):
+        idx = ts % self.size
+        if self.stamps[idx] != ts:
+            self.stamps[idx] = ts
+            self.counts[idx] = 0
+        self.counts[idx] += 1
+        self.total += 1
+
+    def window(self, now, seconds):
+        cutoff = now - seconds
+        return sum(c for c, ts in zip(self.counts, self.stamps) if ts >= cutoff)
+
+ATTEMPTS = RollingCounter()
+SUCCESSES = RollingCounter()
+ERRORS = RollingCounter()
 
+# WORKER
+async def worker(dq, session, visited, visited_log, errors, parse_pool):
     while True:
         try:
-            url, depth = await dq.get()
+            item = await dq.get()
         except asyncio.CancelledError:
             return
+        url, dom, depth = item
 
-        url = normalize(url)
-        ts = int(time.time())
-        dom = urlparse(url).netloc
+        # A bug on one page is recorded against that URL instead of silently
+        # killing the worker and shrinking the pool
+        try:
+            await process_url(dq, session, visited, visited_log, errors, parse_pool, url, dom, depth)
+        except Exception as e:
+            ts = int(time.time())
+            ERRORS.add(ts)
+            errors.put_nowait({
+                "u": url,
+                "t": ts,
+                "e": f"EXC_{type(e).__name__}"
+            })
 
-        # Count attempt
-        TOTAL_ATTEMPTS += 1
-        ATTEMPT_TIMES.append(ts)
+        # Not in a finally: a URL cancelled mid-fetch stays in flight, so the
+        # shutdown snapshot keeps it for the next run
+        dq.task_done(item)
 
-        if url in visited:
-            dq.task_done(url)
-            continue
 
-        if dom:
-            await dq.ensure_sitemaps(session, dom)
+def parse_page(html, url):
+    # Parse and extract in one call so big pages can run both off the loop.
+    # Returns None if the page cannot be parsed.
+    try:
+        tree = LexborHTMLParser(html)
+    except Exception:
+        return None
+    return extract_all_urls(tree, url)
 
-        html, status, ctype, err = await fetch_html(session, url)
 
-        if err:
-            ERROR_TIMES.append(ts)
-            append_json(ERROR_FILE, {
-                "u": url,
-                "t": ts,
-                "e": f"{err}_{status}" if status else err
-            })
-            dq.task_done(url)
-            continue
+async def process_url(dq, session, visited, visited_log, errors, parse_pool, url, dom, depth):
+    ts = int(time.time())
 
-        try:
-            soup = BeautifulSoup(html, "html.parser")
-        except:
-            ERROR_TIMES.append(ts)
-            append_json(ERROR_FILE, {
-                "u": url,
-                "t": ts,
-                "e": "PARSE_ERROR"
-            })
-            dq.task_done(url)
-            continue
+    # Count attempt
+    ATTEMPTS.add(ts)
 
-        # SUCCESS
-        SUCCESS_TIMES.append(ts)
-        visited.add(url)
+    # Sitemap discovery is best effort: a broken sitemap on the host must not
+    # cost us the page itself
+    if dom:
+        try:
+            await dq.ensure_sitemaps(session, dom)
+        except Exception:
+            pass
+
+    html, status, ctype, err = await fetch_html(session, url)
+
+    if err:
+        ERRORS.add(ts)
+        errors.put_nowait({
+            "u": url,
+            "t": ts,
+            "e": f"{err}_{status}" if status else err
+        })
+        return
+
+    # Lexbor holds the GIL, so a thread does not parse faster; it keeps the
+    # event loop responsive instead. Inline, a 2 MB page stalls every other
+    # fetch for the whole parse + extract (hundreds of ms); in the pool the
+    # loop still gets the GIL between the Python-level link steps.
+    if len(html) > PARSE_OFFLOAD_BYTES:
+        loop = asyncio.get_running_loop()
+        urls = await loop.run_in_executor(parse_pool, parse_page, html, url)
+    else:
+        urls = parse_page(html, url)
+
+    # Free the page now: add_url may sleep on the rate limiter, and otherwise
+    # it stays pinned until the next fetch
+    del html
+
+    if urls is None:
+        ERRORS.add(ts)
+        errors.put_nowait({
+            "u": url,
+            "t": ts,
+            "e": "PARSE_ERROR"
+        })
+        return
+
+    # SUCCESS
+    SUCCESSES.add(ts)
+
+    for u, u_dom in urls:
+        await dq.add_url(u, u_dom, depth + 1)
+
+    # Only now is the page done: if shutdown cuts the rate-limited loop above
+    # short, the page stays unvisited and the next run fetches it again
+    visited.add(url)
+    visited_log.append(url)
+
+
+async def error_writer(errors):
+    # Drains the error queue in batches until it receives the None sentinel
+    while True:
+        batch = [await errors.get()]
+        while len(batch) < ERROR_BATCH_SIZE and not errors.empty():
+            batch.append(errors.get_nowait())
+        done = None in batch
+        batch = [e for e in batch if e is not None]
+        if batch:
+            append_jsonl_batch(ERROR_FILE, batch)
+        if done:
+            return
 
-        urls = extract_all_urls(soup, url)
-        for u in urls:
-            if should_skip(u, visited, found):
-                continue
-            await dq.add_url(u, depth + 1)
 
-        async with lock:
-            save_state(dq.dump_state(), visited, found)
+async def snapshot_timer(dq, stores):
+    # `stores` pairs each Bloom filter with its log
+    last_bloom = time.monotonic()
+    while True:
+        await asyncio.sleep(SNAPSHOT_INTERVAL)
+        for _, log in stores:
+            log.flush()
+        if dq.dirty:
+            dq.dirty = False
+            save_queue(dq.dump_state())
 
-        dq.task_done(url)
+        # Filters are tens of MB, so they are written less often; a crash
+        # only means a longer log tail to replay
+        if time.monotonic() - last_bloom >= BLOOM_SNAPSHOT_INTERVAL:
+            last_bloom = time.monotonic()
+            for bloom, log in stores:
+                save_bloom(bloom, log)
 
 
 async def progress_timer(visited):
-    global TOTAL_ATTEMPTS, ATTEMPT_TIMES, SUCCESS_TIMES, ERROR_TIMES
-
     start = time.time()
     last_print = 0
 
@@ -420,96 +841,132 @@ async def progress_timer(visited):
         now = time.time()
         elapsed = int(now - start)
 
-        # Count events in sliding windows
-        def count_in_window(times, seconds):
-            cutoff = now - seconds
-            return sum(1 for t in times if t >= cutoff)
+        # Print every 10 seconds
+        if elapsed - last_print < 10:
+            continue
+        last_print = elapsed
 
         # Totals
         total_success = len(visited)
-        total_errors = len(ERROR_TIMES)
-        total_attempts = TOTAL_ATTEMPTS
+        total_errors = ERRORS.total
+        total_attempts = ATTEMPTS.total
 
         # Global error rate
         global_rate = (total_errors / total_attempts) if total_attempts else 0.0
 
         # Recent 10s
-        recent_attempts = count_in_window(ATTEMPT_TIMES, 10)
-        recent_errors = count_in_window(ERROR_TIMES, 10)
+        recent_attempts = ATTEMPTS.window(now, 10)
+        recent_errors = ERRORS.window(now, 10)
         recent_rate = (recent_errors / recent_attempts) if recent_attempts else 0.0
 
-        # 30s / 60s windows
-        attempts_30 = count_in_window(ATTEMPT_TIMES, 30)
+        # 30s windows
+        attempts_30 = ATTEMPTS.window(now, 30)
 
-        errors_30 = count_in_window(ERROR_TIMES, 30)
+        errors_30 = ERRORS.window(now, 30)
 
-        success_30 = count_in_window(SUCCESS_TIMES, 30)
+        success_30 = SUCCESSES.window(now, 30)
 
         # Moving averages
         error_rate_30 = (errors_30 / attempts_30) if attempts_30 else 0.0
 
         success_rate_30 = (success_30 / attempts_30) if attempts_30 else 0.0
 
-        # Print every 10 seconds
-        if elapsed - last_print >= 10:
-            last_print = elapsed
-
-            print(
-                f"[{elapsed:6d}s] "
-                f"att={total_attempts} "
-                f" - succ={total_success} " # more is better
-                f" - err={total_errors}" # less is better
-                f" - rate.err={global_rate:.3f} " # less is better
-                f" - 10s.err={recent_rate:.3f} " # less is better
-                f" - 30s.err={error_rate_30:.3f} " # less is better
-                f" - 30s.succ={success_rate_30:.3f} " # more is better
-            )
+        print(
+            f"[{elapsed:6d}s] "
+            f"att={total_attempts} "
+            f" - succ={total_success} " # more is better
+            f" - err={total_errors}" # less is better
+            f" - rate.err={global_rate:.3f} " # less is better
+            f" - 10s.err={recent_rate:.3f} " # less is better
+            f" - 30s.err={error_rate_30:.3f} " # less is better
+            f" - 30s.succ={success_rate_30:.3f} " # more is better
+        )
 
 
 # MAIN
 async def crawl_async():
-    queue_list, visited, found = load_state()
+    # Python 3.12+: tasks that finish without blocking (already-processed
+    # sitemaps in the gathers, workers with a ready URL) run inside
+    # create_task instead of waiting for an event-loop trip
+    if hasattr(asyncio, "eager_task_factory"):
+        asyncio.get_running_loop().set_task_factory(asyncio.eager_task_factory)
 
-    limiter = UrlRateLimiter(GLOBAL_URLS_PER_SEC)
-    dq = DomainQueue(visited, found, limiter)
-
-    for url, depth in queue_list:
-        dq.add_seed(url, depth)
+    queue_list, visited, found = load_state()
 
-    lock = asyncio.Lock()
-    start = time.time()
-    empty_since = None
+    visited_log = JsonlLog(VISITED_FILE)
+    found_log = JsonlLog(FOUND_FILE)
 
-    async with aiohttp.ClientSession() as session:
+    limiter = UrlRateLimiter(GLOBAL_URLS_PER_SEC)
+    dq = DomainQueue(visited, found, found_log, limiter)
+
+    dq.add_seeds(queue_list)
+
+    # Startup state is long-lived: move it out of the collector's view, and
+    # run young-generation GC far less often than the 700-allocation default,
+    # which fires constantly under per-page parse/extract churn
+    gc.freeze()
+    gc.set_threshold(*GC_THRESHOLD)
+
+    errors = asyncio.Queue()
+    parse_pool = ThreadPoolExecutor(PARSE_THREADS, thread_name_prefix="parse")
+
+    # No global connection cap (workers already bound concurrency), a small
+    # per-host cap for politeness, and cached async DNS across domains
+    connector = aiohttp.TCPConnector(
+        limit=0,
+        limit_per_host=LIMIT_PER_HOST,
+        ttl_dns_cache=DNS_CACHE_TTL,
+        use_dns_cache=True,
+        resolver=AsyncResolver(),
+        family=socket.AF_INET if IPV4_ONLY else 0,
+        ssl=False,
+        enable_cleanup_closed=True,
+    )
+    async with aiohttp.ClientSession(connector=connector, headers=HEADERS) as session:
         workers = [
-            asyncio.create_task(worker(dq, session, visited, found, lock))
+            asyncio.create_task(worker(dq, session, visited, visited_log, errors, parse_pool))
             for _ in range(CONCURRENCY)
         ]
 
         timer_task = asyncio.create_task(progress_timer(visited))
+        stores = ((visited, visited_log), (found, found_log))
+        snapshot_task = asyncio.create_task(snapshot_timer(dq, stores))
+        writer_task = asyncio.create_task(error_writer(errors))
 
+        # Run until every queued URL has been processed (including links found
+        # along the way) or the time budget runs out
+        join_task = asyncio.create_task(dq.join())
         try:
-            while True:
-                if time.time() - start > AUTO_SHUTDOWN_SECONDS:
-                    break
-
-                if dq.empty():
-                    if empty_since is None:
-                        empty_since = time.time()
-                    elif time.time() - empty_since > 5:
-                        break
-                else:
-                    empty_since = None
-
-                await asyncio.sleep(0.2)
+            await asyncio.wait({join_task}, timeout=AUTO_SHUTDOWN_SECONDS)
 
         finally:
+            join_task.cancel()
             for t in workers:
                 t.cancel()
             timer_task.cancel()
-            await asyncio.gather(*workers, return_exceptions=True)
+            snapshot_task.cancel()
+            await asyncio.wait(workers)
 
-    save_state(dq.dump_state(), visited, found)
+            # Persist on every exit path, including Ctrl-C / cancellation
+            for bloom, log in stores:
+                save_bloom(bloom, log)
+            visited_log.close()
+            found_log.close()
+            save_queue(dq.dump_state())
+
+            # Parses still queued finish in the background; their results are
+            # discarded since the workers are gone
+            parse_pool.shutdown(wait=False)
+
+            # Error log last, so a failing writer cannot cost the state above
+            errors.put_nowait(None)
+            await writer_task
 
 if __name__ == "__main__":
+    # libuv event loop where available (not on Windows); stdlib loop otherwise
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
     asyncio.run(crawl_async())
@@ -1,13 +1,31 @@
-import json
+import argparse
 import logging
 import sys
 import os
 import re
-import requests
+import asyncio
+import aiohttp
 from typing import List, Dict, Tuple, Set
 from datetime import datetime, timezone
 from collections import defaultdict
 
+# JSON
+# orjson when installed; stdlib json (same indented UTF-8 bytes) otherwise
+try:
+    import orjson
+
+    json_loads = orjson.loads
+
+    def json_dumps(data) -> bytes:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2)
+except ImportError:
+    import json
+
+    json_loads = json.loads
+
+    def json_dumps(data) -> bytes:
+        return json.dumps(data, indent=2, ensure_ascii=False).encode("utf-8")
+
 # LOGGING
 logging.basicConfig(
     level=logging.INFO,
@@ -16,6 +34,7 @@ logging.basicConfig(
 logger = logging.getLogger("domain_verifier")
 
 TIMEOUT = 10
+HEAD_TIMEOUT = 5
 USER_AGENT = (
     "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
     "AppleWebKit/537.36 (KHTML, like Gecko) "
@@ -23,12 +42,17 @@ USER_AGENT = (
 )
 DOMAINS_FILE = "domains.json"
 LOG_FILE = "log.json"
+VERIFY_CONCURRENCY = 500
+VERIFY_LIMIT_PER_HOST = 2
+RANGE_ONE_BYTE = {"Range": "bytes=0-0"}
+
+_DOMAIN_RE = re.compile(r'^([a-zA-Z0-9]([a-zA-Z0-9-]*[a-zA-Z0-9])?\.)+[a-zA-Z]{2,}$', re.ASCII)
 
 def load_log_data(filepath: str) -> List[Dict]:
     """Load log data from JSON file."""
     try:
-        with open(filepath, 'r') as f:
-            data = json.load(f)
+        with open(filepath, 'rb') as f:
+            data = json_loads(f.read())
             # Ensure it's a list
             return data if isinstance(data, list) else [data]
     except Exception as e:
@@ -62,23 +86,41 @@ def extract_domains_from_log(log_data: List[Dict]) -> Dict[str, Dict]:
 
 def is_valid_domain(domain: str) -> bool:
     """Check if domain format is valid."""
-    domain_pattern = r'^([a-zA-Z0-9]([a-zA-Z0-9-]*[a-zA-Z0-9])?\.)+[a-zA-Z]{2,}$'
-    return bool(re.match(domain_pattern, domain))
+    return _DOMAIN_RE.match(domain) is not None
 
-def verify_domain_exists(domain: str) -> Tuple[bool, int]:
-    """Verify if a domain is actually accessible and exists. Returns (is_accessible, status_code)."""
-    try:
-        headers = {"User-Agent": USER_AGENT}
-        response = requests.head(f"http://{domain}", timeout=TIMEOUT, headers=headers, allow_redirects=True)
-        return response.status_code < 400, response.status_code
-    except requests.exceptions.Timeout:
+def is_up_status(status: int) -> bool:
+    """Any 2xx/3xx means the host answered; 416 is a ranged GET on an empty body."""
+    return status < 400 or status == 416
+
+async def _verify_one(session: aiohttp.ClientSession, sem: asyncio.Semaphore, domain: str) -> Tuple[bool, int]:
+    """Verify one domain is accessible, bounded by the shared semaphore. Returns (is_accessible, status_code)."""
+    async with sem:
+        try:
+            async with session.head(
+                f"https://{domain}", allow_redirects=False, timeout=aiohttp.ClientTimeout(total=HEAD_TIMEOUT)
+            ) as response:
+                if is_up_status(response.status):
+                    return True, response.status
+        except Exception:
+            pass
         try:
-            response = requests.get(f"http://{domain}", timeout=TIMEOUT, headers=headers, stream=True)
-            return response.status_code < 400, response.status_code
-        except Exception as e:
+            async with session.get(f"http://{domain}", headers=RANGE_ONE_BYTE, allow_redirects=False) as response:
+                return is_up_status(response.status), response.status
+        except Exception:
             return False, 0
-    except Exception as e:
-        return False, 0
+
+async def verify_all(domains: List[str]) -> List[Tuple[bool, int]]:
+    """Verify domains concurrently over one session. Results are in input order."""
+    # Python 3.12+: start each check inside create_task so it reaches its first real await without a loop trip
+    if hasattr(asyncio, "eager_task_factory"):
+        asyncio.get_running_loop().set_task_factory(asyncio.eager_task_factory)
+    sem = asyncio.Semaphore(VERIFY_CONCURRENCY)
+    connector = aiohttp.TCPConnector(limit=0, limit_per_host=VERIFY_LIMIT_PER_HOST)
+    timeout = aiohttp.ClientTimeout(total=TIMEOUT)
+    async with aiohttp.ClientSession(
+        connector=connector, timeout=timeout, headers={"User-Agent": USER_AGENT}
+    ) as session:
+        return await asyncio.gather(*[_verify_one(session, sem, d) for d in domains])
 
 def load_domains_from_file(filepath: str) -> Tuple[List[str], List[Dict]]:
     """Load domains from JSON or text file. Returns tuple of (domain_strings, original_data)."""
@@ -86,8 +128,8 @@ def load_domains_from_file(filepath: str) -> Tuple[List[str], List[Dict]]:
     original_data = []
     try:
         if filepath.endswith('.json'):
-            with open(filepath, 'r') as f:
-                data = json.load(f)
+            with open(filepath, 'rb') as f:
+                data = json_loads(f.read())
                 if isinstance(data, list):
                     original_data = data
                     # Handle list of objects with 'domain' field
@@ -130,19 +172,23 @@ def verify_domains(domains: List[str], original_data: List[Dict], verbose: bool
     total = len(domains)
     logger.info(f"Starting domain verification for {total} domains...")
     
+    # Check format validity up front so only well-formed domains hit the network
+    pending = []
     for idx, domain in enumerate(domains, 1):
         domain = domain.strip().lower()
         original_item = domain_map.get(domain, {"domain": domain})
         
-        # Check format validity
         if not is_valid_domain(domain):
             results["invalid"].append(original_item)
             if verbose:
                 logger.warning(f"[{idx}/{total}] Invalid format: {domain}")
             continue
-        
-        # Check if domain exists
-        is_accessible, status_code = verify_domain_exists(domain)
+        pending.append((idx, domain, original_item))
+    
+    # Check if domains exist, all in one concurrent batch
+    checks = asyncio.run(verify_all([domain for _, domain, _ in pending]))
+    
+    for (idx, domain, original_item), (is_accessible, status_code) in zip(pending, checks):
         if is_accessible:
             original_item["accessible"] = True
             original_item["status_code"] = status_code
@@ -187,17 +233,22 @@ def merge_with_log_entry(original_log: Dict, verified_domains: List[Dict]) -> Di
     return updated_log
 
 
+def save_json_atomic(filepath: str, data) -> None:
+    """Write JSON to a temp file and rename it over the target, so readers never see a partial file."""
+    tmp = filepath + ".tmp"
+    with open(tmp, 'wb') as f:
+        f.write(json_dumps(data))
+    os.replace(tmp, filepath)
+
 def save_results(verified_domains: List[Dict], verified_log: Dict):
     """Save verification results to files."""
     try:
         # Save verified domains in original format
-        with open("verified_domains.json", 'w') as f:
-            json.dump(verified_domains, f, indent=4)
+        save_json_atomic("verified_domains.json", verified_domains)
         logger.info(f"Verified domains saved to verified_domains.json ({len(verified_domains)} domains)")
         
         # Save updated log with verification data
-        with open("verified_log.json", 'w') as f:
-            json.dump([verified_log], f, indent=4)
+        save_json_atomic("verified_log.json", [verified_log])
         logger.info("Verification log saved to verified_log.json")
         
     except Exception as e:
@@ -230,7 +281,7 @@ def main(verbose: bool = False):
     domains_from_log = extract_domains_from_log(log_data)
     
     # Load domains.json for additional metadata
-    domains_data, _ = load_domains_from_file(DOMAINS_FILE)
+    _, domains_data = load_domains_from_file(DOMAINS_FILE)
     if isinstance(domains_data, list) and domains_data:
         domains_json_list = domains_data
     else:
@@ -243,32 +294,39 @@ def main(verbose: bool = False):
         logger.error("No domains found in log")
         sys.exit(1)
     
+    # Index domains.json by lowercase domain; the first entry for a domain wins
+    domains_json_index = {}
+    for domains_entry in domains_json_list:
+        if isinstance(domains_entry, dict) and isinstance(domains_entry.get("domain"), str):
+            domains_json_index.setdefault(domains_entry["domain"].lower(), domains_entry)
+    
     # Verify each domain
     verified_domains = []
     total = total_log_domains
     
     logger.info(f"Starting verification of {total} domains...\n")
     
+    # Check format validity up front so only well-formed domains hit the network
+    pending = []
     for idx, (domain_lower, domain_info) in enumerate(domains_from_log.items(), 1):
         domain = domain_info["domain"]
         
-        # Check format validity
         if not is_valid_domain(domain):
             logger.warning(f"[{idx}/{total}] Invalid format: {domain}")
             continue
-        
-        # Verify domain exists
-        is_accessible, status_code = verify_domain_exists(domain)
+        pending.append((idx, domain_lower, domain_info))
+    
+    # Verify domains exist, all in one concurrent batch
+    checks = asyncio.run(verify_all([info["domain"] for _, _, info in pending]))
+    
+    for (idx, domain_lower, domain_info), (is_accessible, status_code) in zip(pending, checks):
+        domain = domain_info["domain"]
         domain_info["accessible"] = is_accessible
         domain_info["status_code"] = status_code
         
-        # Find corresponding entry in domains.json to enrich data
-        enriched_domain = domain_info.copy()
-        for domains_entry in domains_json_list:
-            if isinstance(domains_entry, dict) and domains_entry.get("domain", "").lower() == domain_lower:
-                # Merge with domains.json data, keeping verification fields
-                enriched_domain = {**domains_entry, **domain_info}
-                break
+        # Enrich with the matching domains.json entry, keeping verification fields
+        domains_entry = domains_json_index.get(domain_lower)
+        enriched_domain = {**domains_entry, **domain_info} if domains_entry else domain_info.copy()
         
         verified_domains.append(enriched_domain)
         
@@ -298,6 +356,16 @@ def main(verbose: bool = False):
     logger.info("Domain verification completed!")
 
 if __name__ == "__main__":
-    # Check for verbose flag
-    verbose = "--verbose" in sys.argv
-    main(verbose=verbose)
+    # libuv event loop for the async checks where available (not on Windows)
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
+    
+    parser = argparse.ArgumentParser(
+        description="Verify crawled domains from domains.json and log.json.", allow_abbrev=False
+    )
+    parser.add_argument("--verbose", action="store_true", help="enable verbose logging")
+    args = parser.parse_args()
+    main(verbose=args.verbose)